@@ -10,6 +10,7 @@ class Settings(BaseSettings):
     project_path: str = "/repo"
     debug_env: str = ".env.debug.template"
     worktree_base: str = "/tmp/debug-worktrees"
+    validate_proxy_requests: bool = False
 
 
 settings = Settings()  # pyright: ignore[reportCallIssue]
@@ -1,24 +1,32 @@
+import asyncio
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any
+from functools import partial
+from typing import cast
 from pydantic import Field
 import logging
 import os
+import secrets
 import subprocess
-from typing import cast
-from urllib.parse import unquote
+import time
 
 from fastapi import FastAPI, Request, Response, HTTPException, Query
+from fastapi.responses import StreamingResponse
 import httpx
 from httpx import AsyncClient
 from pydantic import BaseModel
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from starlette.background import BackgroundTask
 
 from grokomation.config import settings
 from grokomation import processes
-from grokomation.opencode import check_request_validity, InvalidRequestException
+from grokomation.opencode import (
+    check_request_validity,
+    invalidate_openapi_spec,
+    InvalidRequestException,
+)
 
 
 settings = settings  # loading for settings validation for shell scripts
@@ -44,15 +52,30 @@ async def lifespan(app: FastAPI):
             )
             logger.info("Repo cloned successfully")
 
+    app.state.http = AsyncClient(
+        limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+        timeout=httpx.Timeout(10.0),
+    )
+
     yield  # The app runs normally here
 
+    await app.state.http.aclose()
+
 
 app = FastAPI(lifespan=lifespan)
 instances: dict[str, int] = {}  # correlation_id → internal_port
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-limiter = Limiter(key_func=get_remote_address)
+
+def _rate_limit_key(request: Request) -> str:
+    """Rate limit per client IP, and per instance for instance-scoped routes."""
+    address = get_remote_address(request)
+    corr_id = request.path_params.get("corr_id")
+    return f"{address}:{corr_id}" if corr_id else address
+
+
+limiter = Limiter(key_func=_rate_limit_key)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
@@ -91,53 +114,109 @@ class SetupAPIResponse(BaseModel):
     status: str
 
 
-@app.post("/instances", tags=["instances"])
-async def setup(data: SetupRequest) -> SetupAPIResponse:
-    if not data.correlation_id:
-        data.correlation_id = f"corr-{int(datetime.utcnow().timestamp() * 1000)}"
+_pending_setups: dict[str, asyncio.Task[SetupShellResponse]] = {}
+
+
+async def _run_script(*args: str, timeout: float | None = None) -> tuple[bytes, bytes]:
+    """Run a script without blocking the event loop and return (stdout, stderr).
+
+    Raises:
+        subprocess.CalledProcessError: If the script exits with a non-zero status.
+        TimeoutError: If the script does not finish within ``timeout`` seconds.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
     try:
-        results = subprocess.run(
-            ["./setup_env.sh", data.correlation_id],
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=30,
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except TimeoutError:
+        proc.kill()
+        _ = await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            cast("int", proc.returncode), args, stdout, stderr
         )
-        logger.debug("Shell stdout: %s", results.stdout)
-        logger.error("Shell stderr: %s", results.stderr)
+    return stdout, stderr
+
+
+async def _setup_instance(correlation_id: str) -> SetupShellResponse:
+    """Run setup_env.sh for a correlation id and register the new instance."""
+    try:
+        stdout, stderr = await _run_script("./setup_env.sh", correlation_id, timeout=30)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Shell stdout: %s", stdout.decode(errors="replace"))
+            logger.debug("Shell stderr: %s", stderr.decode(errors="replace"))
+        # Only the final line carries the JSON result; pydantic parses bytes.
         shell_response = SetupShellResponse.model_validate_json(
-            results.stdout.splitlines()[-1]
+            stdout.rstrip().rpartition(b"\n")[2]
         )
     except subprocess.CalledProcessError as e:
-        logging.exception(f"Setup failed: {cast('str', e.stderr)}")
+        logging.exception(
+            "Setup failed: %s", cast("bytes", e.stderr).decode(errors="replace")
+        )
         raise HTTPException(500, f"Setup failed: {e}")
+    except TimeoutError:
+        logging.exception("Setup timed out")
+        raise HTTPException(500, "Setup failed: setup_env.sh timed out")
 
-    instances[data.correlation_id] = shell_response.port
+    instances[correlation_id] = shell_response.port
     logger.info(
-        f"Setup complete for correlation_id={data.correlation_id} on port {shell_response.port}"
+        f"Setup complete for correlation_id={correlation_id} on port {shell_response.port}"
     )
     logger.info("Shell response: %s", shell_response)
-    return SetupAPIResponse(
-        **{"status": "setup_complete", "correlation_id": data.correlation_id}
-    )
+    return shell_response
+
+
+def _forget_setup(correlation_id: str, task: asyncio.Task[SetupShellResponse]) -> None:
+    _ = _pending_setups.pop(correlation_id, None)
+    # Mark a failure as retrieved in case every waiting caller disconnected.
+    if not task.cancelled():
+        _ = task.exception()
+
+
+@app.post("/instances", tags=["instances"])
+@limiter.limit("10/minute")
+async def setup(request: Request, data: SetupRequest) -> SetupAPIResponse:
+    if not data.correlation_id:
+        data.correlation_id = f"corr-{time.time_ns():x}-{secrets.token_hex(4)}"
+    correlation_id = data.correlation_id
+
+    if correlation_id in instances:
+        logger.info(f"Instance already set up for correlation_id={correlation_id}")
+        return SetupAPIResponse(status="already_setup", correlation_id=correlation_id)
+
+    # A retry that arrives while setup_env.sh is still running waits for that
+    # run instead of starting a second one for the same correlation id.
+    pending = _pending_setups.get(correlation_id)
+    if pending is not None:
+        logger.info(f"Setup in progress for correlation_id={correlation_id}, waiting")
+        _ = await asyncio.shield(pending)
+        return SetupAPIResponse(status="already_setup", correlation_id=correlation_id)
+
+    task = asyncio.create_task(_setup_instance(correlation_id))
+    _pending_setups[correlation_id] = task
+    task.add_done_callback(partial(_forget_setup, correlation_id))
+    _ = await asyncio.shield(task)
+    return SetupAPIResponse(status="setup_complete", correlation_id=correlation_id)
 
 
 @app.delete("/instances/{corr_id}", tags=["instances"])
 async def cleanup(corr_id: str):
     try:
-        results = subprocess.run(
-            ["./cleanup_env.sh", corr_id],
-            check=True,
-            capture_output=True,
-            text=True,
-        )
-        logger.debug("cleanup_env.sh stdout: %s", results.stdout)
-        logger.debug("cleanup_env.sh stderr: %s", results.stderr)
+        stdout, stderr = await _run_script("./cleanup_env.sh", corr_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("cleanup_env.sh stdout: %s", stdout.decode(errors="replace"))
+            logger.debug("cleanup_env.sh stderr: %s", stderr.decode(errors="replace"))
     except subprocess.CalledProcessError as e:
-        logging.exception(f"Cleanup failed: {cast('str', e.stderr)}")
+        logging.exception(
+            "Cleanup failed: %s", cast("bytes", e.stderr).decode(errors="replace")
+        )
         raise HTTPException(500, f"Cleanup failed: {e}")
 
-    _ = instances.pop(corr_id, None)
+    port = instances.pop(corr_id, None)
+    if port is not None:
+        invalidate_openapi_spec("localhost", port)
     return {"status": "cleaned"}
 
 
@@ -152,9 +231,9 @@ def health_check() -> dict[str, str]:
 
 
 @app.get("/proc/check_port", tags=["processes"])
-async def check_port(port: int) -> processes.OpenCodeHealthResponse:
+async def check_port(request: Request, port: int) -> processes.OpenCodeHealthResponse:
     try:
-        return await processes.check_opencode_health(port)
+        return await processes.check_opencode_health(request.app.state.http, port)
     except processes.OpenCodeHealthError as e:
         raise HTTPException(502, str(e))
 
@@ -183,9 +262,10 @@ async def _proxy_request(corr_id: str, path: str, request: Request) -> Response:
         raise HTTPException(404, "No active session")
     if not path.startswith("/"):
         path = "/" + path
+    client: AsyncClient = request.app.state.http
     try:
         await check_request_validity(
-            "localhost", instances[corr_id], request.method, path
+            client, "localhost", instances[corr_id], request.method, path
         )
     except InvalidRequestException as e:
         raise HTTPException(422, str(e))
@@ -194,24 +274,37 @@ async def _proxy_request(corr_id: str, path: str, request: Request) -> Response:
     except Exception as e:
         raise HTTPException(500, f"Error validating request: {str(e)}")
     url = f"http://localhost:{instances[corr_id]}{path}"
-    headers = {k: v for k, v in request.headers.items() if k.lower() != "host"}
-    headers["content-type"] = "application/json"
-    async with AsyncClient() as client:
-        resp = await client.request(
-            method=request.method,
-            url=url,
-            headers=headers,
-            params=request.query_params,
-            content=await request.body(),
-        )
-    return Response(
-        content=resp.content,
+    # Starlette's raw header names are already lowercased bytes.
+    headers = [
+        (k, v) for k, v in request.headers.raw if k != b"host" and k != b"content-type"
+    ]
+    headers.append((b"content-type", b"application/json"))
+    # Only stream a body when the client sent one; an async iterator makes
+    # httpx send bodiless GET/DELETE requests as chunked.
+    has_body = (
+        "content-length" in request.headers or "transfer-encoding" in request.headers
+    )
+    upstream_request = client.build_request(
+        method=request.method,
+        url=url,
+        headers=headers,
+        params=request.query_params,
+        content=request.stream() if has_body else None,
+    )
+    try:
+        resp = await client.send(upstream_request, stream=True)
+    except httpx.RequestError as e:
+        raise HTTPException(502, f"Error proxying request: {str(e)}")
+    return StreamingResponse(
+        resp.aiter_raw(),
         status_code=resp.status_code,
         headers=dict(resp.headers),
+        background=BackgroundTask(resp.aclose),
     )
 
 
 @app.get("/instances/{corr_id}/proxy", tags=["instances"])
+@limiter.limit("120/minute")
 async def proxy_get(
     corr_id: str,
     request: Request,
@@ -221,6 +314,7 @@ async def proxy_get(
 
 
 @app.post("/instances/{corr_id}/proxy", tags=["instances"])
+@limiter.limit("120/minute")
 async def proxy_post(
     corr_id: str,
     request: Request,
@@ -230,6 +324,7 @@ async def proxy_post(
 
 
 @app.put("/instances/{corr_id}/proxy", tags=["instances"])
+@limiter.limit("120/minute")
 async def proxy_put(
     corr_id: str,
     request: Request,
@@ -239,6 +334,7 @@ async def proxy_put(
 
 
 @app.patch("/instances/{corr_id}/proxy", tags=["instances"])
+@limiter.limit("120/minute")
 async def proxy_patch(
     corr_id: str,
     request: Request,
@@ -248,7 +344,7 @@ async def proxy_patch(
 
 
 @app.delete("/instances/{corr_id}/proxy", tags=["instances"])
-@limiter.limit("5/minute")
+@limiter.limit("5/minute", key_func=get_remote_address)
 async def proxy_delete(
     corr_id: str,
     request: Request,
@@ -1,44 +1,99 @@
+from collections import OrderedDict
+from functools import lru_cache
+import re
 import time
+from typing import NamedTuple
+
 import httpx
 
+from grokomation.config import settings
+
 
 class InvalidRequestException(Exception):
     """Raised when a request does not match the OpenAPI specification."""
 
 
-_spec_cache: dict[tuple[str, int], tuple[dict, float]] = {}
+class RouteTable(NamedTuple):
+    """Allowed methods per path, split into exact paths and templated paths."""
+
+    static: dict[str, frozenset[str]]
+    dynamic: list[tuple[re.Pattern[str], frozenset[str]]]
+
+
+_SPEC_URL_FMT = "http://%s:%d/doc"
+
+_SPEC_CACHE_MAXSIZE = 128
+_spec_cache: OrderedDict[tuple[str, int], tuple[RouteTable, float]] = OrderedDict()
+
 
+@lru_cache(maxsize=1024)
+def path_template_to_regex(template: str) -> str:
+    """Convert an OpenAPI path template (e.g. /session/{id}) to a regex."""
+    parts = re.split(r"\{[^/{}]+\}", template)
+    return "^" + "[^/]+".join(re.escape(part) for part in parts) + "$"
 
-async def get_openapi_spec(hostname: str, port: int, ttl: int = 600) -> dict:
-    """Fetch OpenAPI spec with caching (default 10 minutes)."""
+
+def build_route_table(spec: dict) -> RouteTable:
+    """Precompile the path templates of an OpenAPI spec with their methods."""
+    routes = RouteTable(static={}, dynamic=[])
+    for template, methods in spec.get("paths", {}).items():
+        allowed_methods = frozenset(m.lower() for m in methods)
+        if "{" in template:
+            routes.dynamic.append(
+                (re.compile(path_template_to_regex(template)), allowed_methods)
+            )
+        else:
+            routes.static[template] = allowed_methods
+    return routes
+
+
+async def get_openapi_spec(
+    client: httpx.AsyncClient, hostname: str, port: int, ttl: int = 600
+) -> RouteTable:
+    """Fetch OpenAPI spec as a compiled route table, cached for 10 minutes."""
     key = (hostname, port)
     now = time.time()
 
-    if key in _spec_cache:
-        spec, timestamp = _spec_cache[key]
-        if now - timestamp < ttl:
-            return spec
+    cached = _spec_cache.get(key)
+    if cached is not None and now - cached[1] < ttl:
+        _spec_cache.move_to_end(key)
+        return cached[0]
+
+    response = await client.get(_SPEC_URL_FMT % (hostname, port))
+    response.raise_for_status()
+    spec = response.json()
 
-    url = f"http://{hostname}:{port}/doc"
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        spec = response.json()
+    routes = build_route_table(spec)
+    _spec_cache[key] = (routes, now)
+    _spec_cache.move_to_end(key)
+    if len(_spec_cache) > _SPEC_CACHE_MAXSIZE:
+        _ = _spec_cache.popitem(last=False)
+    return routes
 
-    _spec_cache[key] = (spec, now)
-    return spec
 
+def invalidate_openapi_spec(hostname: str, port: int) -> None:
+    """Drop the cached spec for an instance, e.g. once it has been torn down."""
+    _ = _spec_cache.pop((hostname, port), None)
 
-def validate_request(spec: dict, method: str, path: str) -> None:
-    return
-    """Validate that the method and path are allowed according to the OpenAPI spec."""
-    if "paths" not in spec:
+
+def match_request(routes: RouteTable, method: str, path: str) -> None:
+    """Check a method and path against a compiled route table.
+
+    Raises:
+        InvalidRequestException: If the path is unknown or the method is not allowed.
+    """
+    if not routes.static and not routes.dynamic:
         raise InvalidRequestException("Invalid OpenAPI spec: no paths defined")
 
-    if path not in spec["paths"]:
-        raise InvalidRequestException(f"Path '{path}' not found in OpenAPI spec")
+    allowed_methods = routes.static.get(path)
+    if allowed_methods is None:
+        for pattern, methods in routes.dynamic:
+            if pattern.match(path):
+                allowed_methods = methods
+                break
+        else:
+            raise InvalidRequestException(f"Path '{path}' not found in OpenAPI spec")
 
-    allowed_methods = [m.lower() for m in spec["paths"][path].keys()]
     if method.lower() not in allowed_methods:
         raise InvalidRequestException(
             f"Method '{method}' not allowed for path '{path}'"
@@ -46,8 +101,13 @@ def validate_request(spec: dict, method: str, path: str) -> None:
 
 
 async def check_request_validity(
-    hostname: str, port: int, method: str, path: str
+    client: httpx.AsyncClient, hostname: str, port: int, method: str, path: str
 ) -> None:
-    """Fetch the OpenAPI spec and validate the request."""
-    spec = await get_openapi_spec(hostname, port)
-    validate_request(spec, method, path)
+    """Fetch the OpenAPI spec and validate the request.
+
+    Does nothing unless validate_proxy_requests is enabled in settings.
+    """
+    if not settings.validate_proxy_requests:
+        return
+    routes = await get_openapi_spec(client, hostname, port)
+    match_request(routes, method, path)
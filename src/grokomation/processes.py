@@ -1,29 +1,57 @@
+from itertools import pairwise
+import threading
+import time
+
 import psutil
 
 from httpx import AsyncClient, Timeout, TimeoutException, HTTPStatusError, ConnectError
 from pydantic import BaseModel
 
 
+_PROCS_TTL = 2.0
+_procs_cache: tuple[float, list[dict[str, int | str | None]]] | None = None
+_procs_lock = threading.Lock()
+
+
 def list_opencode_processes() -> list[dict[str, int | str | None]]:
+    """List running OpenCode servers, cached for a short TTL to absorb polling."""
+    global _procs_cache
+    with _procs_lock:
+        now = time.monotonic()
+        if _procs_cache is not None and now - _procs_cache[0] < _PROCS_TTL:
+            return _procs_cache[1]
+        instances = _scan_opencode_processes()
+        _procs_cache = (now, instances)
+        return instances
+
+
+def _invalidate_processes_cache() -> None:
+    global _procs_cache
+    with _procs_lock:
+        _procs_cache = None
+
+
+def _is_opencode_serve(cmd: list[str]) -> bool:
+    # command may include path to opencode, so join
+    return "opencode" in "".join(cmd) and "serve" in cmd
+
+
+def _scan_opencode_processes() -> list[dict[str, int | str | None]]:
     instances: list[dict[str, int | str | None]] = []
-    for proc in psutil.process_iter(["pid", "name", "cmdline"]):
+    for proc in psutil.process_iter():
         try:
-            cmd: list[str] = proc.info["cmdline"] or []
-            if (
-                "opencode"
-                in "".join(cmd)  # command may include path to opencode, so join
-                and "serve" in cmd
-            ):
-                # Try to extract port from cmdline (e.g., --port 4106)
-                port = None
-                hostname = ""
-                for i, arg in enumerate(cmd):
-                    if arg == "--port" and i + 1 < len(cmd):
-                        port = int(cmd[i + 1])
-                        continue
-                    if arg == "--hostname" and i + 1 < len(cmd):
-                        hostname = cmd[i + 1]
-                        continue
+            # name() is a cheap /proc/<pid>/stat read; skip the cmdline read
+            # for everything that is clearly not OpenCode.
+            if "opencode" not in proc.name():
+                continue
+            cmd: list[str] = proc.cmdline() or []
+            if _is_opencode_serve(cmd):
+                # Extract flags from cmdline (e.g., --port 4106) in one pass
+                flags = {
+                    arg: value for arg, value in pairwise(cmd) if arg.startswith("--")
+                }
+                port = int(flags["--port"]) if "--port" in flags else None
+                hostname = flags.get("--hostname", "")
                 instances.append({"pid": proc.pid, "port": port, "hostname": hostname})
         except (psutil.NoSuchProcess, psutil.AccessDenied):
             continue
@@ -32,17 +60,17 @@ def list_opencode_processes() -> list[dict[str, int | str | None]]:
 
 def kill_opencode_process(pid: int) -> tuple[bool, str]:
     """Kill OpenCode process by PID. Returns True if successful."""
-    open_processes = list_opencode_processes()
-    if pid not in [p["pid"] for p in open_processes]:
-        return False, "Process not found or not an OpenCode process."
-
     try:
         proc = psutil.Process(pid)
-    except psutil.NoSuchProcess:
-        return False, "Process does not exist."
+        cmd: list[str] = proc.cmdline() or []
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False, "Process not found or not an OpenCode process."
+    if not _is_opencode_serve(cmd):
+        return False, "Process not found or not an OpenCode process."
     try:
         proc.terminate()
         _ = proc.wait(timeout=3)
+        _invalidate_processes_cache()
         return True, "Process terminated successfully."
     except psutil.TimeoutExpired:
         try:
@@ -50,12 +78,15 @@ def kill_opencode_process(pid: int) -> tuple[bool, str]:
             _ = proc.wait(timeout=3)
         except (psutil.NoSuchProcess, psutil.TimeoutExpired, psutil.AccessDenied) as e:
             return False, f"Failed to kill process. {str(e)}"
+        _invalidate_processes_cache()
         return True, "Process terminated successfully."
     except (psutil.NoSuchProcess, psutil.TimeoutExpired, psutil.AccessDenied) as e:
         return False, f"Failed to terminate process. {str(e)}"
 
 
 default_headers = {"content-type": "application/json"}
+_HEALTH_TIMEOUT = Timeout(1.0)
+_HEALTH_URL_FMT = "http://127.0.0.1:%d/global/health"
 
 
 class OpenCodeHealthResponse(BaseModel):
@@ -67,20 +98,19 @@ class OpenCodeHealthError(Exception): ...
 
 
 async def check_opencode_health(
-    port: int, timeout: float = 1.0
+    client: AsyncClient, port: int, timeout: float | Timeout = _HEALTH_TIMEOUT
 ) -> OpenCodeHealthResponse:
     """Async check if port is running OpenCode server by hitting /global/health."""
-    url = f"http://127.0.0.1:{port}/global/health"
+    url = _HEALTH_URL_FMT % port
     try:
-        async with AsyncClient() as client:
-            resp = await client.request(
-                method="GET", url=url, timeout=Timeout(timeout), headers=default_headers
-            )
-            if resp.status_code == 200:
-                return OpenCodeHealthResponse(**resp.json())
-            raise OpenCodeHealthError(
-                f"Unexpected status code {resp.status_code} from OpenCode health endpoint"
-            )
+        resp = await client.request(
+            method="GET", url=url, timeout=timeout, headers=default_headers
+        )
+        if resp.status_code == 200:
+            return OpenCodeHealthResponse(**resp.json())
+        raise OpenCodeHealthError(
+            f"Unexpected status code {resp.status_code} from OpenCode health endpoint"
+        )
     except (HTTPStatusError, TimeoutException, ConnectError) as e:
         raise OpenCodeHealthError(
             f"Failed to connect to OpenCode server on port {port}: {str(e)}"
@@ -0,0 +1,84 @@
+import asyncio
+import subprocess
+
+import httpx
+import pytest
+
+import grokomation.main as main
+
+
+SETUP_BODY = {"correlation_id": "corr-test", "error": "boom", "host": "h", "type": "t"}
+SHELL_OUTPUT = (
+    b"cloning...\n"
+    b'{"port": 4100, "worktree": "/w", "prod_hash": "a", "master_hash": "b",'
+    b' "compare_advice": "x", "matches_master": true, "pid_file": "/p", "pid": 1}\n'
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    main.limiter.reset()
+    main.instances.clear()
+    main._pending_setups.clear()
+    yield
+    main.instances.clear()
+    main._pending_setups.clear()
+
+
+@pytest.fixture
+def client():
+    transport = httpx.ASGITransport(app=main.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+
+def fake_run_script(calls: list[tuple[str, ...]], fail: bool = False):
+    async def _run_script(*args: str, timeout: float | None = None):
+        calls.append(args)
+        await asyncio.sleep(0.05)
+        if fail:
+            raise subprocess.CalledProcessError(1, args, b"", b"setup broke")
+        return SHELL_OUTPUT, b""
+
+    return _run_script
+
+
+@pytest.mark.asyncio
+async def test_concurrent_setups_run_script_once(monkeypatch, client):
+    calls: list[tuple[str, ...]] = []
+    monkeypatch.setattr(main, "_run_script", fake_run_script(calls))
+
+    async with client:
+        responses = await asyncio.gather(
+            *(client.post("/instances", json=SETUP_BODY) for _ in range(3))
+        )
+
+    assert len(calls) == 1
+    assert sorted(r.json()["status"] for r in responses) == [
+        "already_setup",
+        "already_setup",
+        "setup_complete",
+    ]
+    assert main.instances == {"corr-test": 4100}
+    assert main._pending_setups == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_setup_reaches_every_waiter_and_can_be_retried(
+    monkeypatch, client
+):
+    calls: list[tuple[str, ...]] = []
+    monkeypatch.setattr(main, "_run_script", fake_run_script(calls, fail=True))
+
+    async with client:
+        responses = await asyncio.gather(
+            *(client.post("/instances", json=SETUP_BODY) for _ in range(3))
+        )
+        assert len(calls) == 1
+        assert [r.status_code for r in responses] == [500, 500, 500]
+        assert main._pending_setups == {}
+
+        retry = await client.post("/instances", json=SETUP_BODY)
+
+    assert retry.status_code == 500
+    assert len(calls) == 2
+    assert main.instances == {}
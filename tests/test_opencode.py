@@ -0,0 +1,164 @@
+import httpx
+import pytest
+
+from grokomation import opencode
+from grokomation.opencode import (
+    InvalidRequestException,
+    build_route_table,
+    get_openapi_spec,
+    invalidate_openapi_spec,
+    match_request,
+    path_template_to_regex,
+)
+
+
+SPEC = {
+    "paths": {
+        "/session": {"get": {}, "POST": {}},
+        "/session/{id}": {"get": {}, "delete": {}},
+        "/session/{id}/message": {"post": {}},
+    }
+}
+
+
+def test_path_template_to_regex_matches_one_segment_per_parameter():
+    pattern = path_template_to_regex("/session/{id}/message")
+
+    assert pattern == r"^/session/[^/]+/message$"
+
+
+def test_path_template_to_regex_escapes_literal_parts():
+    pattern = path_template_to_regex("/file.json")
+
+    assert pattern == r"^/file\.json$"
+
+
+def test_build_route_table_lowercases_methods():
+    routes = build_route_table(SPEC)
+
+    assert routes.static["/session"] == frozenset({"get", "post"})
+
+
+def test_build_route_table_handles_missing_paths():
+    routes = build_route_table({})
+
+    assert routes.static == {}
+    assert routes.dynamic == []
+
+
+def test_match_request_accepts_templated_path():
+    routes = build_route_table(SPEC)
+
+    match_request(routes, "DELETE", "/session/abc123")
+    match_request(routes, "POST", "/session/abc123/message")
+
+
+def test_match_request_rejects_extra_segments_in_template():
+    routes = build_route_table(SPEC)
+
+    with pytest.raises(InvalidRequestException, match="not found"):
+        match_request(routes, "GET", "/session/abc/def")
+
+
+def test_match_request_rejects_unknown_path():
+    routes = build_route_table(SPEC)
+
+    with pytest.raises(InvalidRequestException, match="not found"):
+        match_request(routes, "GET", "/unknown")
+
+
+def test_match_request_rejects_disallowed_method():
+    routes = build_route_table(SPEC)
+
+    with pytest.raises(InvalidRequestException, match="not allowed"):
+        match_request(routes, "PUT", "/session/abc123")
+
+
+def test_match_request_rejects_spec_without_paths():
+    routes = build_route_table({})
+
+    with pytest.raises(InvalidRequestException, match="no paths defined"):
+        match_request(routes, "GET", "/session")
+
+
+def test_build_route_table_partitions_static_and_templated_paths():
+    routes = build_route_table(SPEC)
+
+    assert set(routes.static) == {"/session"}
+    assert [pattern.pattern for pattern, _ in routes.dynamic] == [
+        r"^/session/[^/]+$",
+        r"^/session/[^/]+/message$",
+    ]
+
+
+def test_match_request_prefers_static_path_over_template():
+    routes = build_route_table(
+        {"paths": {"/session/{id}": {"delete": {}}, "/session/status": {"get": {}}}}
+    )
+
+    match_request(routes, "GET", "/session/status")
+    with pytest.raises(InvalidRequestException, match="not allowed"):
+        match_request(routes, "DELETE", "/session/status")
+
+
+def test_match_request_falls_through_to_later_template():
+    routes = build_route_table(SPEC)
+
+    match_request(routes, "POST", "/session/abc123/message")
+    with pytest.raises(InvalidRequestException, match="not allowed"):
+        match_request(routes, "GET", "/session/abc123/message")
+
+
+@pytest.fixture
+def spec_client():
+    requested: list[int] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(request.url.port)
+        return httpx.Response(200, json=SPEC)
+
+    opencode._spec_cache.clear()
+    yield httpx.AsyncClient(transport=httpx.MockTransport(handler)), requested
+    opencode._spec_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_get_openapi_spec_caches_per_instance(spec_client):
+    client, requested = spec_client
+
+    async with client:
+        first = await get_openapi_spec(client, "localhost", 4100)
+        second = await get_openapi_spec(client, "localhost", 4100)
+
+    assert first is second
+    assert requested == [4100]
+
+
+@pytest.mark.asyncio
+async def test_get_openapi_spec_evicts_least_recently_used(monkeypatch, spec_client):
+    client, requested = spec_client
+    monkeypatch.setattr(opencode, "_SPEC_CACHE_MAXSIZE", 2)
+
+    async with client:
+        await get_openapi_spec(client, "localhost", 4100)
+        await get_openapi_spec(client, "localhost", 4101)
+        await get_openapi_spec(client, "localhost", 4100)  # refresh 4100
+        await get_openapi_spec(client, "localhost", 4102)  # evicts 4101
+
+        assert list(opencode._spec_cache) == [("localhost", 4100), ("localhost", 4102)]
+
+        await get_openapi_spec(client, "localhost", 4101)
+
+    assert requested == [4100, 4101, 4102, 4101]
+
+
+@pytest.mark.asyncio
+async def test_invalidate_openapi_spec_forces_refetch(spec_client):
+    client, requested = spec_client
+
+    async with client:
+        await get_openapi_spec(client, "localhost", 4100)
+        invalidate_openapi_spec("localhost", 4100)
+        await get_openapi_spec(client, "localhost", 4100)
+
+    assert requested == [4100, 4100]